@@ -1,109 +1,220 @@
 import h5py
+import json
+import hdf5plugin  # Registers the Blosc filter used by script.py
+import matplotlib as mpl
 import matplotlib.pyplot as plt
 import os
 import numpy as np
 import subprocess
+import shutil
+import urllib.error
+import urllib.request
 import curses
 
 # GitHub repo details
 GITHUB_REPO = "https://github.com/aa08453/ML-and-Absorption-Spectroscopy.git"
 HDF5_FILE = "repo/milk_quality.h5"
+HDF5_URL = "https://raw.githubusercontent.com/aa08453/ML-and-Absorption-Spectroscopy/main/milk_quality.h5"
+# Downloads live outside repo/, which script.py only ever treats as a git checkout
+CACHE_DIR = ".cache"
+DOWNLOADED_HDF5_FILE = os.path.join(CACHE_DIR, "milk_quality.h5")
+ETAG_FILE = os.path.join(CACHE_DIR, "milk_quality.etag")  # ETag of the last downloaded HDF5 file
+SAMPLES_CACHE = os.path.join(CACHE_DIR, "samples.json")  # Sample names, valid while the HDF5 mtime is unchanged
+MAX_DRAGGABLE_LEGEND = 50  # Above this many traces, a draggable legend makes interaction sluggish
+
+# Simplify long spectra so rendering and pick hit-testing walk fewer vertices
+mpl.rcParams["path.simplify"] = True
+mpl.rcParams["path.simplify_threshold"] = 1.0
+mpl.rcParams["agg.path.chunksize"] = 10000
+
+def download_hdf5():
+    """Downloads only the HDF5 file, skipping the transfer if it hasn't changed since last time."""
+    request = urllib.request.Request(HDF5_URL)
+    if os.path.exists(DOWNLOADED_HDF5_FILE) and os.path.exists(ETAG_FILE):
+        with open(ETAG_FILE) as f:
+            request.add_header("If-None-Match", f.read().strip())
+
+    partial_file = DOWNLOADED_HDF5_FILE + ".part"
+    try:
+        with urllib.request.urlopen(request, timeout=30) as response:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            with open(partial_file, "wb") as f:
+                shutil.copyfileobj(response, f)
+            os.replace(partial_file, DOWNLOADED_HDF5_FILE)  # Never leave a half-written file behind
+            etag = response.headers.get("ETag")
+    except urllib.error.HTTPError as e:
+        if e.code == 304:  # Not modified; the local copy is current
+            return
+        raise
+    except OSError:  # Includes timeouts while streaming the body, not just URLError
+        if os.path.exists(partial_file):
+            os.remove(partial_file)
+        raise
+
+    if etag:
+        with open(ETAG_FILE, "w") as f:
+            f.write(etag)
 
 def pull_latest_hdf5():
-    if os.path.exists("repo"):
+    """Brings the HDF5 file up to date and returns the path to read it from."""
+    # A git checkout (shared with script.py) must stay clean, so keep pulling it with git
+    if os.path.isdir(os.path.join("repo", ".git")):
         subprocess.run(["git", "-C", "repo", "pull"])
-    else:
+        return HDF5_FILE
+
+    try:
+        download_hdf5()
+        return DOWNLOADED_HDF5_FILE
+    except OSError as e:
+        print(f"Could not download HDF5 file ({e}).")
+
+    if os.path.exists(DOWNLOADED_HDF5_FILE):
+        print("Using the previously downloaded copy.")
+        return DOWNLOADED_HDF5_FILE
+    if not os.path.exists("repo"):
         subprocess.run(["git", "clone", GITHUB_REPO, "repo"])
+    return HDF5_FILE
 
-    if not os.path.exists(HDF5_FILE):
-        print("No existing HDF5 file found on GitHub. Exiting.")
+def open_hdf5(hdf5_path):
+    try:
+        return h5py.File(hdf5_path, "r", libver="latest", swmr=True)
+    except OSError as e:  # Missing or unreadable file; h5py reports which
+        print(f"No database found: {e}")
         exit()
 
-def list_samples(hdf5_file):
-    if not os.path.exists(hdf5_file):
-        print("No database found.")
-        return []
-
-    with h5py.File(hdf5_file, "r") as hdf5_file:
+def list_samples(hdf5_path):
+    """Returns the sample names, opening the HDF5 file only if the cached listing is stale."""
+    try:
+        mtime = os.path.getmtime(hdf5_path)
+        with open(SAMPLES_CACHE) as f:
+            cache = json.load(f)
+        if cache["file"] == hdf5_path and cache["mtime"] == mtime:
+            return cache["samples"]
+    except (OSError, ValueError, KeyError):
+        pass  # No usable cache; list the file below
+
+    with open_hdf5(hdf5_path) as hdf5_file:
         if "samples" not in hdf5_file:
             print("No samples found in HDF5 file.")
             return []
+        samples = list(hdf5_file["samples"].keys())
 
-        return list(hdf5_file["samples"].keys())
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(SAMPLES_CACHE, "w") as f:
+            json.dump({"file": hdf5_path, "mtime": os.path.getmtime(hdf5_path), "samples": samples}, f)
+    except OSError:
+        pass  # Caching is best-effort
+    return samples
 
 def plot_samples(hdf5_file, selected_samples):
-    if not os.path.exists(hdf5_file):
-        print("No database found.")
-        return
-
-    with h5py.File(hdf5_file, "r") as hdf5_file:
-        fig, ax = plt.subplots(figsize=(10, 6))
-        handles = []
-        labels = []
-        visibility = {}  # Track visibility of each plot
-
-        for sample in selected_samples:
-            group_name = f"samples/{sample}"
-            if group_name not in hdf5_file:
-                print(f"Warning: Sample {sample} not found. Skipping.")
-                continue
-
-            group = hdf5_file[group_name]
-            wavelengths = group["Wavelengths"][:]
-            absorption = group["Absorption"][:]
-
-            line, = ax.plot(wavelengths, absorption, label=sample)  
-            handles.append(line)
-            labels.append(sample)
-            visibility[line] = True  # Initially, all plots are visible
-
-        ax.set_xlabel("Wavelength (nm)")
-        ax.set_ylabel("Absorption")
-        ax.set_title("Wavelength vs Absorption")
-        ax.grid()
-
-        # Create interactive legend
-        leg = ax.legend(handles, labels, loc="upper right", fontsize=10, frameon=True)
-        leg.set_draggable(True)
-
-        # Make legend items clickable
-        def toggle_visibility(event):
-            """Handles legend click events to toggle visibility."""
-            for line, leg_line in zip(handles, leg.get_lines()):
-                if event.artist == leg_line:
-                    visible = not line.get_visible()
-                    line.set_visible(visible)
-                    leg_line.set_alpha(1.0 if visible else 0.3)  # Dim legend text if hidden
-                    fig.canvas.draw()
-
-        fig.canvas.mpl_connect("pick_event", toggle_visibility)  # Enable clicking legend
-        for leg_line in leg.get_lines():
-            leg_line.set_picker(True)  # Make legend items clickable
-
-        plt.show()
+    fig, ax = plt.subplots(figsize=(10, 6))
+    groups = []
+    labels = []
+
+    for sample in selected_samples:
+        group_name = f"samples/{sample}"
+        if group_name not in hdf5_file:
+            print(f"Warning: Sample {sample} not found. Skipping.")
+            continue
+
+        groups.append(hdf5_file[group_name])
+        labels.append(sample)
+
+    # Read every spectrum straight into one preallocated block (NaN-padded to the longest)
+    lengths = [group["Absorption"].shape[0] for group in groups]
+    wavelengths = np.full((max(lengths, default=0), len(groups)), np.nan)
+    absorption = np.full_like(wavelengths, np.nan)
+    for i, (group, length) in enumerate(zip(groups, lengths)):
+        group["Wavelengths"].read_direct(wavelengths, dest_sel=np.s_[:length, i])
+        group["Absorption"].read_direct(absorption, dest_sel=np.s_[:length, i])
+
+    handles = ax.plot(wavelengths, absorption) if groups else []
+
+    ax.set_xlabel("Wavelength (nm)")
+    ax.set_ylabel("Absorption")
+    ax.set_title("Wavelength vs Absorption")
+    ax.grid()
+
+    # Create interactive legend
+    leg = ax.legend(handles, labels, loc="upper right", fontsize=10, frameon=True)
+    leg.set_draggable(len(handles) <= MAX_DRAGGABLE_LEGEND)
+
+    # Map each legend line to its plotted line once, instead of scanning on every click
+    legline_to_line = dict(zip(leg.get_lines(), handles))
+
+    # Lines and legend are animated: a full draw caches everything else as a background,
+    # so a toggle only restores that background and redraws these artists on top
+    overlay = [*handles, leg]
+    for artist in overlay:
+        artist.set_animated(True)
+    background = None
+
+    def draw_overlay(renderer):
+        for artist in overlay:
+            artist.draw(renderer)
+
+    def on_draw(event):
+        """Caches the background after each full draw (resize, zoom, legend drag)."""
+        nonlocal background
+        if event.canvas.supports_blit:
+            background = event.canvas.copy_from_bbox(fig.bbox)
+        draw_overlay(event.renderer)  # Also keeps the lines in saved figures
+
+    fig.canvas.mpl_connect("draw_event", on_draw)
+
+    # Make legend items clickable
+    def toggle_visibility(event):
+        """Handles legend click events to toggle visibility."""
+        line = legline_to_line.get(event.artist)
+        if line is None:
+            return
+
+        visible = not line.get_visible()
+        line.set_visible(visible)
+        event.artist.set_alpha(1.0 if visible else 0.3)  # Dim legend text if hidden
+
+        if background is None:  # Backend without blitting support
+            fig.canvas.draw_idle()
+            return
+        fig.canvas.restore_region(background)
+        draw_overlay(fig.canvas.get_renderer())
+        fig.canvas.blit(fig.bbox)
+
+    fig.canvas.mpl_connect("pick_event", toggle_visibility)  # Enable clicking legend
+    for leg_line in leg.get_lines():
+        leg_line.set_picker(True)  # Make legend items clickable
+
+    plt.show()
 
 def select_samples_curses(stdscr, timestamps):
     curses.curs_set(0)
     selected = [False] * len(timestamps)
     current = 0
+    top = 0  # Index of the first timestamp shown; only the visible window is drawn
+    height, width = stdscr.getmaxyx()
 
     while True:
-        stdscr.clear()
-        height, width = stdscr.getmaxyx()
+        stdscr.erase()  # Unlike clear(), doesn't force a full repaint of the terminal
+        rows = max(height - 2, 1)
+        top = min(max(top, current - rows + 1), current)
 
         stdscr.addstr(0, 0, "Use ↑ ↓ to navigate, SPACE to select, ENTER to confirm", curses.A_BOLD)
 
-        for i, ts in enumerate(timestamps):
-            if i + 2 >= height:
-                break
-
+        for row, i in enumerate(range(top, min(top + rows, len(timestamps)))):
+            ts = timestamps[i]
             mode = curses.A_REVERSE if i == current else curses.A_NORMAL
             mark = "[X] " if selected[i] else "[ ] "
             ts_display = ts[:width - 6] if len(ts) > width - 6 else ts
-            stdscr.addstr(i + 2, 0, mark + ts_display, mode)
+            stdscr.addstr(row + 2, 0, mark + ts_display, mode)
+
+        stdscr.noutrefresh()
+        curses.doupdate()  # Sends only the changed cells to the terminal
 
         key = stdscr.getch()
-        if key == curses.KEY_UP and current > 0:
+        if key == curses.KEY_RESIZE:
+            height, width = stdscr.getmaxyx()
+        elif key == curses.KEY_UP and current > 0:
             current -= 1
         elif key == curses.KEY_DOWN and current < len(timestamps) - 1:
             current += 1
@@ -122,13 +233,15 @@ def run_curses_selection(timestamps):
         curses.endwin()
 
 if __name__ == "__main__":
-    pull_latest_hdf5()
-    available_samples = list_samples(HDF5_FILE)
+    hdf5_path = pull_latest_hdf5()
+    available_samples = list_samples(hdf5_path)
 
     if available_samples:
         selected_samples = run_curses_selection(available_samples)
 
         if selected_samples:
-            plot_samples(HDF5_FILE, selected_samples)
+            # The file is only opened here when the listing came from the cache
+            with open_hdf5(hdf5_path) as hdf5_file:
+                plot_samples(hdf5_file, selected_samples)
         else:
             print("No valid timestamps selected.")
@@ -1,20 +1,41 @@
 import h5py
+import hdf5plugin
 import pandas as pd
 import os
 import numpy as np
 import subprocess
 import shlex
 import glob
+from concurrent.futures import ProcessPoolExecutor
+
+try:  # Optional: faster multi-threaded CSV parsing for AS7341 files
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
 
 # GitHub repo details
 GITHUB_REPO = "https://github.com/aa08453/ML-and-Absorption-Spectroscopy.git"
 HDF5_FILE = "repo/milk_quality.h5"  
+# New-style (indexed) groups, while staying readable by HDF5 1.10+ rather than only the newest release
+HDF5_LIBVER = ("v110", "latest")
 
 # AS7341 Wavelength Mapping
 AS7341_WAVELENGTHS = np.array([415, 445, 480, 515, 555, 590, 630, 680, 850, 940])  # Estimated NIR bands
+AS7341_CHANNELS = ["415nm_F1", "445nm_F2", "480nm_F3", "515nm_F4", "555nm_F5",
+                   "590nm_F6", "630nm_F7", "680nm_F8", "CLEAR", "NIR"]
+SPECTROPHOTOMETER_COLUMNS = ["Wavelength", "Absorption", "Transmission"]
+AS7341_CHUNK_ROWS = 1024  # Rows per HDF5 chunk for the AS7341 table
+
+# Blosc/zstd with bit-shuffle for numeric datasets (readers must import hdf5plugin)
+COMPRESSION = hdf5plugin.Blosc(cname="zstd", clevel=3, shuffle=hdf5plugin.Blosc.BITSHUFFLE)
 
 def pull_latest_hdf5():
-    """Pull the latest HDF5 file from GitHub and ensure it stays inside `repo/`."""
+    """Pull the latest HDF5 file from GitHub and ensure it stays inside `repo/`.
+
+    Datasets are Blosc-compressed, so any reader must `import hdf5plugin`
+    before opening the file with h5py.
+    """
     if os.path.exists("repo"):
         subprocess.run(["git", "-C", "repo", "pull"])
     else:
@@ -23,8 +44,9 @@ def pull_latest_hdf5():
     # Ensure HDF5 file exists inside repo
     if not os.path.exists(HDF5_FILE):
         print("No existing HDF5 file found in the repo. Creating a new one.")
-        with h5py.File(HDF5_FILE, "w") as f:
-            f.create_group("samples")  # Initialize empty HDF5 file
+        with h5py.File(HDF5_FILE, "w", libver=HDF5_LIBVER) as f:
+            f.create_group("samples", track_order=False)  # Initialize empty HDF5 file
+            init_as7341_group(f)  # Writes the shared AS7341 wavelengths once
 
 def collect_csv_files(inputs):
     """Collects CSV files from folders or filenames."""
@@ -39,97 +61,164 @@ def collect_csv_files(inputs):
             print(f"Skipping: {item} (Not a valid folder or CSV file)")
     return all_csv_files
 
+def init_as7341_group(hdf5_file):
+    """Creates the AS7341 table (one row per sample) if it does not exist yet.
+
+    `Batch[i]` is the ingestion run row i came from; that run's metadata is
+    stored as attributes on `batches/<Batch[i]>`.
+    """
+    if "AS7341" in hdf5_file:
+        return hdf5_file["AS7341"]
+
+    group = hdf5_file.create_group("AS7341")
+    group.create_dataset("Wavelengths", data=AS7341_WAVELENGTHS)  # Shared by all rows
+    group.create_dataset("Timestamps", shape=(0,), maxshape=(None,), dtype=h5py.string_dtype(),
+                         chunks=(AS7341_CHUNK_ROWS,))
+    group.create_dataset("Intensities", shape=(0, len(AS7341_CHANNELS)),
+                         maxshape=(None, len(AS7341_CHANNELS)), dtype=np.float32,
+                         chunks=(AS7341_CHUNK_ROWS, len(AS7341_CHANNELS)),
+                         fill_time="never", **COMPRESSION)  # Rows are always written right after a resize
+    group.create_dataset("Batch", shape=(0,), maxshape=(None,), dtype=np.int32,
+                         chunks=(AS7341_CHUNK_ROWS,), fill_time="never", **COMPRESSION)
+    group.create_group("batches")
+    return group
+
+def append_rows(dataset, rows):
+    """Grows a resizable dataset along its first axis and writes `rows` at the end."""
+    start = dataset.shape[0]
+    dataset.resize(start + len(rows), axis=0)
+    dataset[start:] = rows
+
+def parse_as7341_csv(csv_file):
+    """Reads an AS7341 CSV into (timestamps, intensities) arrays, one row per sample."""
+    if pa is not None:
+        column_types = {"time": pa.string(), **{channel: pa.float32() for channel in AS7341_CHANNELS}}
+        # Only empty cells count as missing, matching the pandas path below
+        convert_options = pa_csv.ConvertOptions(column_types=column_types, null_values=[""])
+        table = pa_csv.read_csv(csv_file, convert_options=convert_options)
+        timestamps = table.column("time").to_numpy(zero_copy_only=False).astype(str)
+        intensities = np.column_stack([table.column(channel).to_numpy(zero_copy_only=False)
+                                       for channel in AS7341_CHANNELS])
+        return timestamps, intensities
+
+    # Keep `time` as the raw text (e.g. "1.50", "") so both parsers yield the same keys
+    df = pd.read_csv(csv_file, dtype={"time": str}, keep_default_na=False,
+                     na_values={channel: [""] for channel in AS7341_CHANNELS})
+    timestamps = df["time"].to_numpy(dtype=str)
+    intensities = df[AS7341_CHANNELS].to_numpy(dtype=np.float32)
+    return timestamps, intensities
+
+def add_as7341_samples(csv_files, hdf5_file):
+    """Parses AS7341 CSVs in parallel, then appends all new rows in a single write."""
+    as7341_group = init_as7341_group(hdf5_file)
+
+    # Parsing is CPU-bound and independent per file; HDF5 writes stay in this process
+    if len(csv_files) > 1:
+        with ProcessPoolExecutor() as executor:
+            parsed = list(executor.map(parse_as7341_csv, csv_files))
+    else:
+        parsed = [parse_as7341_csv(csv_file) for csv_file in csv_files]
+
+    for csv_file, (timestamps, _) in zip(csv_files, parsed):
+        print(f"Processing: {csv_file} ({len(timestamps)} rows)")
+
+    timestamps = np.concatenate([timestamps for timestamps, _ in parsed])
+    intensities = np.concatenate([intensities for _, intensities in parsed])
+
+    # Skip samples already stored (or repeated across the CSVs) with one hashed pass
+    timestamps_series = pd.Series(timestamps)
+    duplicate = timestamps_series.isin(as7341_group["Timestamps"].asstr()[:]) | timestamps_series.duplicated()
+    keep = ~duplicate.to_numpy()
+    if not keep.all():
+        print(f"Skipping {len(keep) - keep.sum()} duplicate samples")
+
+    timestamps, intensities = timestamps[keep], intensities[keep]
+    if len(timestamps) == 0:
+        return [], False
+
+    # Metadata describes this ingestion run, so it goes on a batch group the new rows point to
+    batch_id = len(as7341_group["batches"])
+    batch_group = as7341_group.create_group(f"batches/{batch_id}")
+
+    # Append all rows in one write instead of one group per sample
+    append_rows(as7341_group["Timestamps"], timestamps)
+    append_rows(as7341_group["Intensities"], intensities)
+    append_rows(as7341_group["Batch"], np.full(len(timestamps), batch_id, dtype=np.int32))
+
+    metadata_updates = add_metadata(batch_group)  # Track if metadata was added
+    print(f"Added {len(timestamps)} AS7341 samples")
+
+    return list(timestamps), metadata_updates
+
 def add_samples_from_csv(csv_files, hdf5_file, data_type):
-    """Processes and adds CSV data to the HDF5 file."""
+    """Processes and adds CSV data to an open HDF5 file."""
     added_samples = []  # Track timestamps for commit message
     metadata_updates = False
 
-    with h5py.File(hdf5_file, "a") as hdf5_file:
-        if "samples" not in hdf5_file:
-            hdf5_file.create_group("samples")  # Ensure samples group exists
-
-        for csv_file in csv_files:
-            print(f"Processing: {csv_file}")
-            
-            if data_type == "1":  # RGB Sensor Data
-                df = pd.read_csv(csv_file)
-                for _, row in df.iterrows():
-                    timestamp = str(row["Timestamp"]).replace("Time, ", "")
-                    group_name = f"/samples/{timestamp}"
-
-                    if group_name in hdf5_file:
-                        print(f"Skipping duplicate sample: {timestamp}")
-                        continue
-
-                    R, G, B = row["R"], row["G"], row["B"]
-                    wavelengths, absorption, transmission = rgb_to_spectrometer(R, G, B)
-
-                    sample_group = hdf5_file.create_group(group_name)
-                    sample_group.create_dataset("Wavelengths", data=wavelengths)
-                    sample_group.create_dataset("Absorption", data=absorption)
-                    sample_group.create_dataset("Transmission", data=transmission)
-
-                    sample_group.attrs["Timestamp"] = timestamp
-                    add_metadata(sample_group)
-
-                    print(f"Added RGB sample: {timestamp}")
-
-            elif data_type == "2":  # Spectrophotometer Data
-                with open(csv_file, 'r') as file:
-                    lines = file.readlines()
-                    timestamp = lines[1].split("\t")[-1].strip().replace("Time, ", "")
-
-                df = pd.read_csv(csv_file, skiprows=11, sep=r'\s*,\s*', engine="python",
-                                 names=["Wavelength", "Absorption", "Transmission"])
-
-                try:
-                    wavelengths = df["Wavelength"].astype(float).values
-                    absorption = df["Absorption"].astype(float).values
-                    transmission = df["Transmission"].astype(float).values
-                except ValueError as e:
-                    print(f"Error processing {csv_file}: Could not convert data to float. {e}")
-                    continue
+    if "samples" not in hdf5_file:
+        hdf5_file.create_group("samples", track_order=False)  # Ensure samples group exists
+
+    if data_type == "3":  # AS7341 10-Channel Sensor Data
+        return add_as7341_samples(csv_files, hdf5_file)
+
+    existing = set(hdf5_file["samples"].keys())  # One listing instead of a lookup per row
 
+    for csv_file in csv_files:
+        print(f"Processing: {csv_file}")
+        
+        if data_type == "1":  # RGB Sensor Data
+            df = pd.read_csv(csv_file)
+            # Pull the needed columns out once instead of indexing a Series per row
+            timestamps = df["Timestamp"].astype(str).str.replace("Time, ", "", regex=False)
+            rgb_values = df[["R", "G", "B"]].to_numpy()
+            for timestamp, (R, G, B) in zip(timestamps, rgb_values):
+                if timestamp in existing:
+                    print(f"Skipping duplicate sample: {timestamp}")
+                    continue
+                existing.add(timestamp)
                 group_name = f"/samples/{timestamp}"
 
-                if group_name in hdf5_file:
-                    del hdf5_file[group_name]
+                wavelengths, absorption, transmission = rgb_to_spectrometer(R, G, B)
 
                 sample_group = hdf5_file.create_group(group_name)
-                sample_group.create_dataset("Wavelengths", data=wavelengths)
-                sample_group.create_dataset("Absorption", data=absorption)
-                sample_group.create_dataset("Transmission", data=transmission)
-                sample_group.attrs["Timestamp"] = timestamp
+                sample_group.create_dataset("Wavelengths", data=wavelengths, **COMPRESSION)
+                sample_group.create_dataset("Absorption", data=absorption, **COMPRESSION)
+                sample_group.create_dataset("Transmission", data=transmission, **COMPRESSION)
 
+                sample_group.attrs["Timestamp"] = timestamp
                 add_metadata(sample_group)
-                print(f"Added spectrophotometer sample: {timestamp}")
 
-            elif data_type == "3":  # AS7341 10-Channel Sensor Data
-                df = pd.read_csv(csv_file)
-                for _, row in df.iterrows():
-                    timestamp = str(row["time"])  # Extract timestamp
-                    group_name = f"/samples/{timestamp}"
+                print(f"Added RGB sample: {timestamp}")
 
-                    if group_name in hdf5_file:
-                        print(f"Skipping duplicate sample: {timestamp}")
-                        continue
+        elif data_type == "2":  # Spectrophotometer Data
+            with open(csv_file, 'r') as file:
+                lines = file.readlines()
+                timestamp = lines[1].split("\t")[-1].strip().replace("Time, ", "")
 
-                    # Extract all 10 channels
-                    intensities = np.array([
-                        row["415nm_F1"], row["445nm_F2"], row["480nm_F3"], row["515nm_F4"],
-                        row["555nm_F5"], row["590nm_F6"], row["630nm_F7"], row["680nm_F8"],
-                        row["CLEAR"], row["NIR"]
-                    ]).astype(float)  # Convert to float for storage
+            df = pd.read_csv(csv_file, skiprows=11, sep=r'\s*,\s*', engine="python",
+                             names=SPECTROPHOTOMETER_COLUMNS)
 
-                    sample_group = hdf5_file.create_group(group_name)
-                    sample_group.create_dataset("Wavelengths", data=AS7341_WAVELENGTHS)
-                    sample_group.create_dataset("Intensities", data=intensities)
+            try:
+                # One conversion of the whole block; columns are then views into it
+                spectrum = df[SPECTROPHOTOMETER_COLUMNS].to_numpy(dtype=np.float64)
+                wavelengths, absorption, transmission = spectrum.T
+            except ValueError as e:
+                print(f"Error processing {csv_file}: Could not convert data to float. {e}")
+                continue
 
-                    sample_group.attrs["Timestamp"] = timestamp
-                    metadata_updates |= add_metadata(sample_group)  # Track if metadata was added
-                    added_samples.append(timestamp)
+            group_name = f"/samples/{timestamp}"
 
-                    print(f"Added AS7341 sample: {timestamp}")
+            if group_name in hdf5_file:
+                del hdf5_file[group_name]
+
+            sample_group = hdf5_file.create_group(group_name)
+            sample_group.create_dataset("Wavelengths", data=wavelengths, **COMPRESSION)
+            sample_group.create_dataset("Absorption", data=absorption, **COMPRESSION)
+            sample_group.create_dataset("Transmission", data=transmission, **COMPRESSION)
+            sample_group.attrs["Timestamp"] = timestamp
+
+            add_metadata(sample_group)
+            print(f"Added spectrophotometer sample: {timestamp}")
 
     return added_samples, metadata_updates
 
@@ -151,43 +240,51 @@ def add_metadata(sample_group):
 
 def view_samples(hdf5_file):
     """Displays stored samples and metadata, handling different data sources."""
-    if not os.path.exists(hdf5_file):
-        print("No database found.")
+    if "samples" not in hdf5_file:
+        print("No samples found in HDF5 file.")
         return
-
-    with h5py.File(hdf5_file, "r") as hdf5_file:
-        if "samples" not in hdf5_file:
-            print("No samples found in HDF5 file.")
-            return
-        
-        print("\nAvailable Timestamps:")
-        for sample in hdf5_file["samples"]:
-            print(f" - {sample}")
-
-        for sample in hdf5_file["samples"]:
-            group = hdf5_file[f"samples/{sample}"]
-            metadata = {key: group.attrs[key] for key in group.attrs}
-
-            print(f"\nTimestamp: {metadata['Timestamp']}")
-
-            # Check if Wavelengths exist before accessing
-            if "Wavelengths" in group:
-                wavelengths = group["Wavelengths"][:]
-                print(f"Wavelengths: {wavelengths[:5]} ...")
-
-            # Check if Absorption and Transmission exist (Spectrophotometer data)
-            if "Absorption" in group and "Transmission" in group:
-                absorption = group["Absorption"][:]
-                transmission = group["Transmission"][:]
-                print(f"Absorption: {absorption[:5]} ...")
-                print(f"Transmission: {transmission[:5]} ...")
-
-            # Check if Intensities exist (AS7341 Color Sensor data)
-            if "Intensities" in group:
-                intensities = group["Intensities"][:]
-                print(f"Intensities: {intensities[:5]} ...")
-
-            print(f"Metadata: {metadata}")
+    
+    # Single pass over the samples, reading only the first few values of each dataset
+    print("\nAvailable Timestamps:")
+    for sample, group in hdf5_file["samples"].items():
+        metadata = dict(group.attrs)
+
+        print(f" - {sample}")
+
+        # Check if Wavelengths exist before accessing
+        if "Wavelengths" in group:
+            print(f"   Wavelengths: {group['Wavelengths'][:5]} ...")
+        elif "Intensities" in group and "AS7341" in hdf5_file:
+            # AS7341 samples share one wavelength array instead of storing their own
+            print(f"   Wavelengths: {hdf5_file['AS7341/Wavelengths'][:5]} ...")
+
+        # Check if Absorption and Transmission exist (Spectrophotometer data)
+        if "Absorption" in group and "Transmission" in group:
+            print(f"   Absorption: {group['Absorption'][:5]} ...")
+            print(f"   Transmission: {group['Transmission'][:5]} ...")
+
+        # Check if Intensities exist (AS7341 Color Sensor data)
+        if "Intensities" in group:
+            print(f"   Intensities: {group['Intensities'][:5]} ...")
+
+        print(f"   Metadata: {metadata}")
+
+    # AS7341 samples are stored as a single table rather than per-sample groups
+    if "AS7341" in hdf5_file:
+        group = hdf5_file["AS7341"]
+        timestamps = group["Timestamps"].asstr()[:5]
+        intensities = group["Intensities"][:5]
+
+        print(f"\nAS7341 samples: {group['Timestamps'].shape[0]}")
+        print(f"Wavelengths: {group['Wavelengths'][:]}")
+        for timestamp, row in zip(timestamps, intensities):
+            print(f" - {timestamp}: {row}")
+
+        # Each batch's metadata applies only to the rows tagged with that batch
+        batch_sizes = np.bincount(group["Batch"][:], minlength=len(group["batches"]))
+        for batch_id in sorted(group["batches"], key=int):
+            metadata = dict(group["batches"][batch_id].attrs)
+            print(f"Batch {batch_id}: {batch_sizes[int(batch_id)]} samples, Metadata: {metadata}")
 
 def push_updated_hdf5(added_samples, data_type, metadata_updates):
     """Pushes the updated HDF5 file back to GitHub with a detailed commit message."""
@@ -196,8 +293,7 @@ def push_updated_hdf5(added_samples, data_type, metadata_updates):
         print("Error: HDF5 file missing. Aborting push.")
         return
     
-    os.chdir("repo")
-    subprocess.run(["git", "add", "milk_quality.h5"])
+    subprocess.run(["git", "-C", "repo", "add", "milk_quality.h5"])
 
     # **Format commit message**
     source_map = {"1": "RGB Sensor", "2": "Spectrophotometer", "3": "AS7341 Sensor"}
@@ -209,9 +305,8 @@ def push_updated_hdf5(added_samples, data_type, metadata_updates):
         f"Timestamps: {', '.join(added_samples) if added_samples else 'None'}"
     )
 
-    subprocess.run(["git", "commit", "-m", commit_message])
-    subprocess.run(["git", "push", "origin", "main"])
-    os.chdir("..")  # Return to original directory
+    subprocess.run(["git", "-C", "repo", "commit", "-m", commit_message])
+    subprocess.run(["git", "-C", "repo", "push", "origin", "main"])
 
 if __name__ == "__main__":
     pull_latest_hdf5()
@@ -224,9 +319,12 @@ if __name__ == "__main__":
         print("No valid CSV files found. Exiting.")
     else:
         TYPE = input("Enter CSV source (1 for RGB, 2 for spectrophotometer, 3 for AS7341 color sensor): ")
-        added_samples, metadata_updates = add_samples_from_csv(CSV_FILES, HDF5_FILE, TYPE)
 
-        print("\nViewing updated database:")
-        view_samples(HDF5_FILE)
+        # Open the file once for both writing and viewing; it must be closed before pushing
+        with h5py.File(HDF5_FILE, "a", libver=HDF5_LIBVER) as hdf5_file:
+            added_samples, metadata_updates = add_samples_from_csv(CSV_FILES, hdf5_file, TYPE)
+
+            print("\nViewing updated database:")
+            view_samples(hdf5_file)
 
         push_updated_hdf5(added_samples, TYPE, metadata_updates)